@@ -21,6 +21,7 @@ import os
 import select
 from serial.serialutil import Timeout
 import termios
+import fcntl
 
 status_codes = ['STATUS_OK',
                 'STATUS_BUSY',
@@ -40,8 +41,145 @@ status_message = ['Action performed successfully',
                   'Not used for now',
                   'The provided arguments are outside the allowed range']
 
-def lookup():
+default_patterns = ['/dev/ttyACM*', '/dev/ttyUSB*', '/dev/serial/by-id/*']
+
+cache_file = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'bincoms', 'lookup.json')
+
+def _candidate_ports(patterns):
+    """ Return a dict {device: aliases} of the serial ports matching patterns
+
+    Symbolic links (such as /dev/serial/by-id entries) are resolved
+    and kept as aliases of the device they point to.
+    """
     import glob
+    ports = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            dev = os.path.realpath(path)
+            aliases = ports.setdefault(dev, [])
+            if path != dev:
+                aliases.append(path)
+    return ports
+
+def _usb_serial_numbers():
+    try:
+        from serial.tools import list_ports
+        return {os.path.realpath(p.device): p.serial_number for p in list_ports.comports()}
+    except Exception:
+        return {}
+
+def _load_cache(filename):
+    import json
+    try:
+        with open(filename) as fid:
+            return json.load(fid)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(cache, filename):
+    import json
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + '.tmp', 'w') as fid:
+            json.dump(cache, fid, indent=1)
+        os.replace(filename + '.tmp', filename)
+    except OSError:
+        pass
+
+def probe(dev, baudrate=115200, timeout=0.2, identify=None):
+    """ Attempt to connect to a bincoms device on port dev
+
+    Parameters:
+    -----------
+    dev: str
+      Path to the serial port
+    baudrate: int
+    timeout: float
+      Timeout for each read on the port in seconds
+    identify: callable
+      If provided, called with the connected SerialBC object. Should
+      return a dict of device specific information, or None if the
+      device is not of the expected type.
+
+    return:
+    -------
+    dict with keys commands (the list of command names) and info (the
+    result of identify), or None if no bincoms device answered.
+    """
+    d = None
+    try:
+        d = SerialBC(dev, baudrate=baudrate, debug=False, timeout=timeout)
+        if not d.commands:
+            return None
+        info = identify(d) if identify is not None else {}
+        return {'commands': d.commands, 'info': info}
+    except Exception:
+        return None
+    finally:
+        if d is not None and hasattr(d, 'com'):
+            d.com.close()
+
+def lookup(patterns=default_patterns, baudrate=115200, timeout=0.2, identify=None, namespace=None, refresh=False, cache=cache_file):
+    """ Discover the bincoms devices connected to the host
+
+    All candidate ports are probed concurrently. Results for USB
+    devices are cached by serial number so that known devices are
+    not probed again (opening the port may reset some boards). Ports
+    without a serial number, or where no device answered, are always
+    probed. Ports in use by another SerialBC (see the exclusive
+    argument of SerialBC) are skipped.
+
+    Parameters:
+    -----------
+    patterns: list of glob patterns for the candidate ports
+    baudrate: int
+    timeout: float
+      Timeout for each read during probes in seconds
+    identify: callable
+      See probe
+    namespace: str
+      Cached results are only reused by callers using the same
+      namespace, as the info they hold depends on identify. Default to
+      the qualified name of identify.
+    refresh: bool
+      Ignore the cache and probe all the ports
+    cache: str
+      Cache file. Disable the cache if empty.
+
+    return:
+    -------
+    list of dict with keys dev, aliases, serial_number, commands and
+    info, one for each port where a device answered.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    if namespace is None:
+        namespace = '' if identify is None else f'{identify.__module__}.{identify.__qualname__}'
+    ports = _candidate_ports(patterns)
+    serial_numbers = _usb_serial_numbers()
+    known = _load_cache(cache).get(namespace, {}) if (cache and not refresh) else {}
+    results = {}
+    to_probe = []
+    for dev in ports:
+        sn = serial_numbers.get(dev)
+        if sn and sn in known:
+            results[dev] = known[sn]
+        else:
+            to_probe.append(dev)
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=len(to_probe)) as executor:
+            probes = executor.map(lambda dev: probe(dev, baudrate, timeout, identify), to_probe)
+            for dev, result in zip(to_probe, probes):
+                results[dev] = result
+        if cache:
+            updated = _load_cache(cache)
+            entries = updated.setdefault(namespace, {})
+            for dev in to_probe:
+                sn = serial_numbers.get(dev)
+                if sn and results[dev] is not None:
+                    entries[sn] = results[dev]
+            _save_cache(updated, cache)
+    return [dict(dev=dev, aliases=ports[dev], serial_number=serial_numbers.get(dev), **results[dev])
+            for dev in ports if results[dev] is not None]
 
 def _command_factory(self, f, s, a):
     def func(self, *args):
@@ -53,6 +191,11 @@ def _command_factory(self, f, s, a):
             if self.debug:
                 print(f'data: {r}')
             return r.decode()
+        elif a == b'r':
+            # Variable length binary answer, left to the caller to decode
+            if self.debug:
+                print(f'data: {r}')
+            return r
         else:
             try:
                 answer = struct.unpack(a, r)
@@ -68,11 +211,15 @@ def _command_factory(self, f, s, a):
     return types.MethodType(func, self)
 
 class SerialBC(object):
-    def __init__(self, dev='/dev/ttyUSB0', baudrate=115200, debug=True, reset=False):
+    def __init__(self, dev='/dev/ttyUSB0', baudrate=115200, debug=True, reset=False, timeout=3, exclusive=True):
         self.debug=debug
         self._dev = dev
         self._baudrate = baudrate
-        self._open(reset=reset)
+        # Lock the port so that other SerialBC (e.g. lookup probes)
+        # cannot interfere with the communication
+        self._exclusive = exclusive
+        self.commands = []
+        self._open(timeout=timeout, reset=reset)
         #self.com.set_low_latency_mode(True)
         #time.sleep(5)
         #self.com.flush()
@@ -92,14 +239,22 @@ class SerialBC(object):
         if self.debug:
             print('Port closed')
         f=os.open(self._dev, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
-        attrs = termios.tcgetattr(f)
-        attrs[2] = attrs[2] & ~termios.HUPCL
-        termios.tcsetattr(f, termios.TCSAFLUSH, attrs)
-        os.close(f)
+        try:
+            if self._exclusive:
+                # Check the lock before flushing the port
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise serial.SerialException(f'Port {self._dev} is in use by another process')
+            attrs = termios.tcgetattr(f)
+            attrs[2] = attrs[2] & ~termios.HUPCL
+            termios.tcsetattr(f, termios.TCSAFLUSH, attrs)
+        finally:
+            os.close(f)
         if self.debug:
             print('Port set')
         try:
-            self.com = serial.Serial(self._dev, baudrate=self._baudrate, timeout=timeout, dsrdtr=None)
+            self.com = serial.Serial(self._dev, baudrate=self._baudrate, timeout=timeout, dsrdtr=None, exclusive=self._exclusive)
         except:
             print('Connexion failed')
         if self.debug:
@@ -126,11 +281,14 @@ class SerialBC(object):
     def _register_commands(self):
         self._get_nfunc = _command_factory(self, 0x00, b'', b'B')
         self._get_func_name = _command_factory(self, 0x01, b'BB', b's')
+        commands = []
         for i in range(2, self._get_nfunc()):
             name, arg_format, answer_format = [self._get_func_name(i, a) for a in range(3)]
             if self.debug:
                 print(f'Registering user function "{name}"')
             setattr(self, name, _command_factory(self, i, arg_format.encode(), answer_format.encode()))
+            commands.append(name)
+        self.commands = commands
                     
     def rcv(self):
         b = self.com.read(3)
@@ -172,5 +330,8 @@ if __name__ == '__main__':
         help='link to a specific tty port')
     args = parser.parse_args()
     
+    if not args.tty:
+        for device in lookup(cache=''):
+            print(f"{device['dev']}: {device['commands']}")
     for dev in args.tty:
         d = SerialBC(dev)
@@ -32,6 +32,9 @@ adc_pin_maps = {'A0': 0,
                 'GND': 0b1111, # Ground
                 }
 
+# Maximum number of samples in a single adc_burst answer (see main.cpp)
+adc_burst_max = 64
+
 signature_bytes_map = {('0x1E', '0x95', '0x0F'): 'Atmega328P',
                        ('0x1E', '0x96', '0x08'): 'ATmega640',
                        ('0x1E', '0x97', '0x03'): 'ATmega1280',
@@ -71,6 +74,7 @@ class LogicTimer(bincoms.SerialBC):
         self._ts_gain = self.read_signature_row(0x0003)
         #
         self.duration = 1
+        self.lines = []
         #
         self.frequency = self.get_frequency()
 
@@ -105,64 +109,228 @@ class LogicTimer(bincoms.SerialBC):
                 break
         return data
 
-    def read_mcu_temperature(self):
-        V_adc = self.read_adc(adc_pin_maps['MCU_TEMP'])
+    def _mcu_temperature(self, V_adc):
         return (V_adc - 273 + 100 - self._ts_offset)*128/self._ts_gain + 25
 
+    def read_mcu_temperature(self, navg=1):
+        ''' Return the MCU temperature in °C
+
+        If navg > 1, the temperature is averaged over navg conversions
+        performed in a single burst (if supported by the firmware).
+        '''
+        if navg > 1 and 'adc_burst' in self.commands:
+            V_adc = self.read_adc_burst(['MCU_TEMP'], 1, navg)[0, 0]
+        else:
+            V_adc = self.read_adc(adc_pin_maps['MCU_TEMP'])
+        return self._mcu_temperature(V_adc)
+
+    def read_adc_burst(self, channels=['MCU_TEMP'], n=1, navg=1):
+        ''' Read n samples of several ADC channels with a minimal number of round trips
+
+        Parameters:
+        -----------
+        channels: list
+          Channel names (keys of adc_pin_maps)
+        n: int
+          Number of samples
+        navg: int
+          Number of conversions averaged in each sample (at most adc_burst_max)
+
+        return:
+        -------
+        ndarray of shape (n, len(channels)) with the averaged ADC values
+        '''
+        codes = [adc_pin_maps[c] for c in channels]
+        if len(set(codes)) != len(codes):
+            raise ValueError(f'Duplicated channels in {channels}')
+        if not 1 <= navg <= adc_burst_max:
+            raise ValueError(f'navg should be between 1 and {adc_burst_max}')
+        if n == 0:
+            return np.zeros((0, len(codes)))
+        mask = 0
+        for c in codes:
+            mask |= 1 << c
+        # The device sends the channels ordered by number
+        columns = np.argsort(np.argsort(codes))
+        per_burst = adc_burst_max // len(codes)
+        samples = []
+        for i in range(0, n, per_burst):
+            r = self.adc_burst(mask, min(per_burst, n - i), navg)
+            samples.append(np.frombuffer(r, dtype='<u2').reshape(-1, len(codes)))
+        return np.concatenate(samples)[:, columns] / navg
+
+    def timed_adc_bursts(self, channels=['MCU_TEMP'], nbursts=1, n=1, navg=1):
+        ''' Interleave ADC bursts with readings of the MCU clock
+
+        The timer should have been started (see start_timer).
+
+        return:
+        -------
+        t: ndarray of shape (nbursts,)
+          MCU time in seconds read just before each burst
+        values: ndarray of shape (nbursts, n, len(channels))
+          The samples of each burst (see read_adc_burst)
+        '''
+        t = np.empty(nbursts)
+        values = np.empty((nbursts, n, len(channels)))
+        for i in range(nbursts):
+            t[i] = self.get_time() / self.frequency
+            values[i] = self.read_adc_burst(channels, n, navg)
+        return t, values
+
     def enable_lines(self, line_list):
         for l in line_list:
             if len(l) != 2:
                 raise ValueError(f"Line identifier {l} does not comply with expected format [0-6][fr]")
             lid, front = int(l[0]), l[1].encode() 
             self.enable_line(lid, front)
+        self.lines = self.lines + [l for l in line_list if l not in self.lines]
+
+
+def identify(device):
+    ''' Return the MCU description of a bincoms device if it is a logic timer, None otherwise'''
+    if not {'start', 'enable_line', 'get_time', 'read_signature_row'}.issubset(device.commands):
+        return None
+    signature_row = [device.read_signature_row(b) for b in [0x0, 0x1, 0x2]]
+    mcu = signature_bytes_map.get(tuple(f'0x{b:02X}' for b in signature_row), 'unknown')
+    return {'signature_row': signature_row, 'mcu': mcu}
 
+def lookup(refresh=False):
+    ''' List the logic timers connected to the host (see bincoms.lookup)'''
+    devices = bincoms.lookup(baudrate=1000000, identify=identify, namespace='logic_timer', refresh=refresh)
+    return [d for d in devices if d['info'] is not None]
+
+def find_device(name=None):
+    ''' Resolve the path of the serial port of a logic timer
+
+    name can be a path to a port, which is returned as is, or the USB
+    serial number, or a /dev/serial/by-id alias of the device (full
+    path or basename, matched exactly). If
+    name is None, the only logic timer connected is returned.
+    '''
+    import os
+    if name is not None and os.path.exists(name):
+        return name
+    devices = lookup()
+    if name is not None:
+        devices = [d for d in devices
+                   if name == d['serial_number']
+                   or any(name in (alias, os.path.basename(alias)) for alias in d['aliases'])]
+    if len(devices) == 1:
+        return devices[0]['dev']
+    elif not devices:
+        raise ValueError('No logic timer found' + (f' matching {name}' if name else ''))
+    else:
+        raise ValueError(f'Several logic timers found ({", ".join(d["dev"] for d in devices)}), specify one with --tty')
+
+def to_record(data, frequency):
+    ''' Convert a list of (count, pinstate) packets into a record array
+
+    The record has one entry per event with columns count (raw mcu
+    clock count), time (in seconds) and pinstate.
+    '''
+    data = [(r[0], r[0]/frequency, r[1]) for r in data]
+    return np.rec.fromrecords(data, names=['count', 'time', 'pinstate'])
+
+def line_intervals(data):
+    ''' Yield (pin, intervals) for each line present in the record
+
+    intervals are the time differences between successive events on
+    the line. The end of record entry (pinstate 255) is skipped.
+    '''
+    pins = set(data['pinstate'])
+    pins.discard(255)
+    for pin in sorted(pins):
+        t = data['time'][data['pinstate'] == pin]
+        yield pin, t[1:] - t[:-1]
         
 @app.command(help='Print the device identification and status')
 def status(
-        tty: Annotated[str, Option('--tty', '-t', help='Specify a tty port for the device')] = '/dev/ttyACM0',
+        tty: Annotated[Optional[str], Option('--tty', '-t', help='Specify a tty port or the name (USB serial number) of the device. Default to the only logic timer connected')] = None,
         verbose: Annotated[bool, Option('--verbose', '-v', help='Display communcation debuging messages')]=False,
         reset: Annotated[bool, Option('--reset', '-r', help='Reset the device')]=False,):
     '''
     '''
-    d = LogicTimer(dev=tty, baudrate=1000000, debug=verbose, reset=reset)
+    d = LogicTimer(dev=find_device(tty), baudrate=1000000, debug=verbose, reset=reset)
     print(f'Logic timer: {d.signature_row}, MCU temperature: {d.read_mcu_temperature()}, frequency calibration constant: {d.frequency}')
     
 @app.command(help='Record events for a given duration')
 def record(
     duration: Annotated[float, Argument(help="Record duration in seconds")],
-    tty: Annotated[str, Option('--tty', '-t', help='Specify a tty port for the device')] = '/dev/ttyACM0',
+    tty: Annotated[Optional[str], Option('--tty', '-t', help='Specify a tty port or the name (USB serial number) of the device. Default to the only logic timer connected')] = None,
     verbose: Annotated[bool, Option('--verbose', '-v', help='Display communcation debuging messages')]=False,
     reset: Annotated[bool, Option('--reset', '-r', help='Reset the device')]=False,
     lines: Annotated[List[str], Option('--lines', '-l', help='Specify the lines to monitor. Each line identifier should be a line number followed by r (to timestamp rising fronts), f (to timestamp falling fronts) or b (to timestamp both fronts).')]=['0b', '1b'],
-    output_file: Annotated[str, Option('--output-file', '-o', help='File name for the record')] = 'timing.npy',):
-    d = LogicTimer(dev=tty, baudrate=1000000, debug=verbose, reset=reset)
+    output_file: Annotated[Optional[str], Option('--output-file', '-o', help='File name for the record (default timing.npy, or timing.raw in raw mode)')] = None,
+    raw: Annotated[bool, Option('--raw', help='Write the serial stream to disk without decoding it (see the decode command)')]=False,):
+    d = LogicTimer(dev=find_device(tty), baudrate=1000000, debug=verbose, reset=reset)
     d.set_duration(duration)
     d.enable_lines(lines)
     print(f'Recording lines {lines} for {duration}s')
-    data = d.get_data()
-    data = [(r[0], r[0]/d.frequency, r[1]) for r in data]
-    result = np.rec.fromrecords(data, names=['count', 'time', 'pinstate'])
+    if raw:
+        import logic_timer.raw_capture
+        if output_file is None:
+            output_file = 'timing.raw'
+        logic_timer.raw_capture.capture(d, output_file)
+        print(f'Raw capture saved to file {output_file}')
+        return
+    if output_file is None:
+        output_file = 'timing.npy'
+    result = to_record(d.get_data(), d.frequency)
+    print(f'Record saved to file {output_file}')
+    np.save(output_file, result)
+
+@app.command(help='Convert a raw capture into a regular record')
+def decode(
+    filename: Annotated[str, Argument(help="Raw capture file")],
+    output_file: Annotated[str, Option('--output-file', '-o', help='File name for the record')] = 'timing.npy',
+    jobs: Annotated[int, Option('--jobs', '-j', help='Number of chunks decoded in parallel')] = 1,):
+    import logic_timer.raw_capture
+    result, header = logic_timer.raw_capture.decode(filename, jobs=jobs)
+    print(f'Decoded {len(result)} events recorded for {header["duration"]}s on lines {header["lines"]}')
     print(f'Record saved to file {output_file}')
     np.save(output_file, result)
 
+@app.command(name='lookup', help='List the logic timers connected to the host')
+def lookup_devices(
+        refresh: Annotated[bool, Option('--refresh', help='Probe all ports again, ignoring cached results')]=False,):
+    devices = lookup(refresh=refresh)
+    if not devices:
+        print('No logic timer found')
+    for d in devices:
+        print(f"{d['dev']}: {d['info']['mcu']}, serial number: {d['serial_number']}, aliases: {d['aliases']}")
+
 @app.command(help='Plot the content of a record')
-def display(filename: Annotated[str, Argument(help="Record duration in seconds")]):
+def display(filename: Annotated[str, Argument(help="Record duration in seconds")],
+            spectrum: Annotated[bool, Option('--spectrum', '-s', help='Display the power spectrum of the event rate and the interval autocorrelation of each line')]=False,
+            binsize: Annotated[float, Option('--binsize', '-b', help='Bin duration in seconds for the event rate')]=1e-3,):
     import matplotlib.pyplot as plt
+    if spectrum:
+        import logic_timer.analysis
+        result = logic_timer.analysis.analyse(filename, binsize=binsize)
+        fig = plt.figure('spectrum')
+        ax1, ax2 = fig.subplots(2, 1)
+        for i, pin in enumerate(result['pins']):
+            ax1.loglog(result['freqs'][1:], result['psd'][i][1:], label=pin)
+            ax2.plot(result['acf'][i], '.-', label=pin)
+        ax1.set_xlabel('frequency [Hz]')
+        ax1.set_ylabel(r'rate PSD [events$^2$/s$^2$/Hz]')
+        ax2.set_xlabel('lag [intervals]')
+        ax2.set_ylabel('interval autocorrelation')
+        ax1.legend()
+        plt.tight_layout()
+        plt.show()
+        return
     data = np.load(filename)
-    pins = set(data['pinstate'])
-    pins.remove(255)
+    lines = list(line_intervals(data))
     fig0 = plt.figure('records')
     ax = fig0.subplots(1, 1)
     fig = plt.figure('intervals')
-    axes = fig.subplots(len(pins), 1, squeeze=False)
-    
-    def diff(x):
-        return x[1:]-x[:-1]
+    axes = fig.subplots(len(lines), 1, squeeze=False)
     
-    for i, pin in enumerate(pins):
+    for i, (pin, intervals) in enumerate(lines):
         goods = data['pinstate'] == pin
         ax.plot(data['time'][goods], '.', label=pin)
-        intervals = diff(data['time'][goods])
         emean = np.mean(intervals)
         rms = intervals.std()
         axes[i][0].plot(intervals, '.', label=pin)
@@ -176,11 +344,11 @@ def display(filename: Annotated[str, Argument(help="Record duration in seconds")
 @app.command(help='Run the clock calibration routine for the given duration')
 def calibrate(duration_min: Annotated[float, Option('--duration', '-d', help='Duration of the procedure in minutes')]=1,
               output_file: Annotated[str, Option('--output-file', '-o', help='Record the clock calibration data to the provided file')] = '',
-              tty: Annotated[str, Option('--tty', '-t', help='Specify a tty port for the device')] = '/dev/ttyACM0',
+              tty: Annotated[Optional[str], Option('--tty', '-t', help='Specify a tty port or the name (USB serial number) of the device. Default to the only logic timer connected')] = None,
               verbose: Annotated[bool, Option('--verbose', '-v', help='Display communcation debuging messages')]=False,
               reset: Annotated[bool, Option('--reset', '-r', help='Reset the device')]=False,):
     import logic_timer.clock_calibration
-    device = LogicTimer(dev=tty, baudrate=1000000, debug=verbose, reset=reset)
+    device = LogicTimer(dev=find_device(tty), baudrate=1000000, debug=verbose, reset=reset)
     mcu_data, ntp_data = logic_timer.clock_calibration.acquire_clock_data(device, duration=duration_min*60)
     slope, eslope = logic_timer.clock_calibration.clock_calibration_fit(mcu_data['start'], mcu_data['mcu'])
     print(f'Measured a time scale difference of {(slope-1) * 100:.4f}% (±{eslope*100:.4f}%)')
@@ -195,10 +363,10 @@ def calibrate(duration_min: Annotated[float, Option('--duration', '-d', help='Du
 
 @app.command(help='Call a raw function of the device and print the returned value')
 def raw(action: Annotated[str, Argument(help="Record duration in seconds")],
-        tty: Annotated[str, Option('--tty', '-t', help='Specify a tty port for the device')] = '/dev/ttyACM0',
+        tty: Annotated[Optional[str], Option('--tty', '-t', help='Specify a tty port or the name (USB serial number) of the device. Default to the only logic timer connected')] = None,
         verbose: Annotated[bool, Option('--verbose', '-v', help='Display communcation debuging messages')]=False,
         reset: Annotated[bool, Option('--reset', '-r', help='Reset the device')]=False):
-    d = LogicTimer(dev=tty, baudrate=1000000, debug=verbose, reset=reset)
+    d = LogicTimer(dev=find_device(tty), baudrate=1000000, debug=verbose, reset=reset)
     if not hasattr(d, action):
         print(f'Unknown command {action}')
         print(f'known: {list_methods(d)}')
@@ -209,10 +377,10 @@ def raw(action: Annotated[str, Argument(help="Record duration in seconds")],
 def start_server(
         hostname: Annotated[str, Option('--hostname', '-H', help='Specify the address to listen')] = '0.0.0.0',
         port: Annotated[int, Option('--port', '-p', help='Specify a port for the server')] = 7912,
-        tty: Annotated[str, Option('--tty', '-t', help='Specify a tty port for the device')] = '/dev/ttyACM0',
+        tty: Annotated[Optional[str], Option('--tty', '-t', help='Specify a tty port or the name (USB serial number) of the device. Default to the only logic timer connected')] = None,
         verbose: Annotated[bool, Option('--verbose', '-v', help='Display communcation debuging messages (inhibit daemonisation)')]=False,
         reset: Annotated[bool, Option('--reset', '-r', help='Reset the device')]=False):
-    d = LogicTimer(dev=tty, baudrate=1000000, debug=verbose, reset=reset)
+    d = LogicTimer(dev=find_device(tty), baudrate=1000000, debug=verbose, reset=reset)
     import logic_timer.daemon_servers
     server = daemon_servers.BasicServer((hostname, port), 'logic-timer', d)
     print(f"Listening on http://{hostname}:{port}")
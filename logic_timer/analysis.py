@@ -0,0 +1,170 @@
+''' Rate series, power spectra and interval autocorrelation of the lines
+
+The functions below process records in chunks so that long records
+(millions of events) can be analysed from memory mapped files. The
+results of analyse are cached per record file.
+'''
+
+import hashlib
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'logic_timer', 'analysis')
+
+
+def record_lines(data, chunk_size=2**20):
+    ''' Return the sorted list of line flags present in the record'''
+    n = np.zeros(256, dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        n += np.bincount(data['pinstate'][start:start + chunk_size], minlength=256)[:256]
+    n[255] = 0
+    return list(np.flatnonzero(n))
+
+
+def rate_series(data, binsize=1e-3, chunk_size=2**20):
+    ''' Count the events of each line in bins of binsize seconds
+
+    Parameters:
+    -----------
+    data: record array (possibly memory mapped) with columns time and pinstate
+    binsize: float
+      Bin duration in seconds
+    chunk_size: int
+      Number of events processed at once
+
+    return:
+    -------
+    pins: list of the line flags
+    counts: ndarray of shape (len(pins), nbins)
+      Number of events of each line in each bin, the first bin
+      starting at the beginning of the record
+    '''
+    pins = record_lines(data, chunk_size)
+    npins = max(len(pins), 1)
+    lut = np.full(256, -1, dtype=np.int64)
+    lut[pins] = np.arange(len(pins))
+    nbins = max(int(np.ceil(data['time'][-1] / binsize)), 1) if len(data) else 1
+    # Bin major indexing so that each chunk of sorted events only
+    # updates a contiguous slice of the counts
+    counts = np.zeros(nbins * npins, dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        line = lut[chunk['pinstate']]
+        b = (chunk['time'] / binsize).astype(np.int64)
+        keep = (line >= 0) & (b >= 0) & (b < nbins)
+        if not keep.any():
+            continue
+        index = b[keep] * npins + line[keep]
+        offset = index.min()
+        partial = np.bincount(index - offset)
+        counts[offset:offset + len(partial)] += partial
+    return pins, counts.reshape(nbins, npins).T[:len(pins)]
+
+
+def welch(x, fs, nperseg=4096, segments_per_chunk=256):
+    ''' Averaged periodogram of x with Hann windowed, half overlapping segments
+
+    Parameters:
+    -----------
+    x: 1d array
+    fs: float
+      Sampling frequency in Hz
+    nperseg: int
+      Segment length, reduced to len(x) for short series
+
+    return:
+    -------
+    freqs: ndarray of frequencies in Hz
+    psd: ndarray of the one sided power spectral density of x
+    '''
+    x = np.asarray(x, dtype=float)
+    nperseg = min(nperseg, len(x))
+    step = max(nperseg // 2, 1)
+    window = np.hanning(nperseg)
+    segments = sliding_window_view(x, nperseg)[::step]
+    psd = np.zeros(nperseg // 2 + 1)
+    for start in range(0, len(segments), segments_per_chunk):
+        s = segments[start:start + segments_per_chunk]
+        s = (s - s.mean(axis=1, keepdims=True)) * window
+        psd += (np.abs(np.fft.rfft(s, axis=1)) ** 2).sum(axis=0)
+    psd /= fs * (window ** 2).sum() * len(segments)
+    # One sided spectrum: fold the negative frequencies but for DC and Nyquist
+    psd[1:(nperseg + 1) // 2] *= 2
+    return np.fft.rfftfreq(nperseg, 1 / fs), psd
+
+
+def interval_autocorrelation(intervals, maxlag=100):
+    ''' Normalized autocorrelation of the intervals for lags 0 to maxlag'''
+    x = np.asarray(intervals, dtype=float)
+    n = len(x)
+    if n < 2:
+        return np.full(maxlag + 1, np.nan)
+    x = x - x.mean()
+    # Zero padding to a power of 2 avoids circular wrapping and slow FFT sizes
+    nfft = 1 << int(2 * n - 1).bit_length()
+    f = np.fft.rfft(x, nfft)
+    acf = np.fft.irfft(np.abs(f) ** 2, nfft)[:min(maxlag, n - 1) + 1]
+    result = np.full(maxlag + 1, np.nan)
+    result[:len(acf)] = acf / acf[0] if acf[0] > 0 else np.nan
+    return result
+
+
+def _cache_file(filename, **params):
+    st = os.stat(filename)
+    key = repr((os.path.abspath(filename), st.st_size, st.st_mtime_ns, sorted(params.items())))
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+
+def analyse(filename, binsize=1e-3, nperseg=4096, maxlag=100, cache=True):
+    ''' Rate spectrum and interval autocorrelation of each line of a record
+
+    Only the spectra and autocorrelations are cached, which keeps the
+    cache files small. Use rate_series for the binned rates.
+
+    Parameters:
+    -----------
+    filename: str
+      Record file (as saved by the record or decode commands)
+    binsize: float
+      Bin duration of the rate series in seconds
+    nperseg: int
+      Segment length (in bins) of the averaged periodograms
+    maxlag: int
+      Maximal lag (in intervals) of the autocorrelation
+    cache: bool
+      Reuse (and store) the results computed for the same record and parameters
+
+    return:
+    -------
+    dict with keys:
+      pins: line flags
+      binsize: bin duration in seconds
+      freqs: ndarray (nfreqs,), frequencies in Hz
+      psd: ndarray (npins, nfreqs), power spectral density of the rate
+      acf: ndarray (npins, maxlag+1), interval autocorrelation
+    '''
+    cache_file = _cache_file(filename, binsize=binsize, nperseg=nperseg, maxlag=maxlag)
+    if cache and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            result = {key: cached[key] for key in cached.files}
+        result['binsize'] = float(result['binsize'])
+        return result
+    data = np.load(filename, mmap_mode='r')
+    pins, counts = rate_series(data, binsize)
+    spectra = [welch(c / binsize, 1 / binsize, nperseg) for c in counts]
+    freqs = spectra[0][0] if spectra else np.zeros(0)
+    psd = np.array([s[1] for s in spectra]).reshape(len(pins), len(freqs))
+    acf = np.zeros((len(pins), maxlag + 1))
+    for i, pin in enumerate(pins):
+        t = data['time'][data['pinstate'] == pin]
+        acf[i] = interval_autocorrelation(t[1:] - t[:-1], maxlag)
+    result = {'pins': np.array(pins), 'binsize': binsize, 'freqs': freqs, 'psd': psd, 'acf': acf}
+    if cache:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(cache_file + '.tmp.npz', **result)
+            os.replace(cache_file + '.tmp.npz', cache_file)
+        except OSError:
+            pass
+    return result
@@ -7,7 +7,7 @@ import tqdm
 server="pool.ntp.org"
 client = ntplib.NTPClient()
         
-def acquire_clock_data(device, duration=600, ntp=0, interval=0.1):
+def acquire_clock_data(device, duration=600, ntp=0, interval=0.1, temperature_every=10, navg=16):
     ''' Acquire clock synchronisation data from the host and mcu.
     
     Note:
@@ -23,21 +23,40 @@ def acquire_clock_data(device, duration=600, ntp=0, interval=0.1):
       If non zero, attempt to perform ntp queries at the provided interval to check the host clock calibration as well
     interval: float
       Approximate interval between 2 mcu queries in seconds
+    temperature_every: int
+      Read the mcu temperature every temperature_every mcu queries.
+      Each reading is a single burst of navg conversions, so the
+      temperature costs one round trip every temperature_every queries
+      instead of one per query, at the price of a coarser temperature
+      sampling (interval * temperature_every seconds). Use 1 to read
+      the temperature at every query.
+    navg: int
+      Number of ADC conversions averaged in each temperature reading
 
     return:
     -------
     mcu_data: numpy record array
+      The mcu_temp column holds the last temperature reading and the
+      temp_time column the host time at which it was performed. Rows
+      where temp_time differs from stop repeat an earlier reading.
     ntp_data: numpy record array
     '''
-    def mcu_tic():
+    if temperature_every < 1:
+        raise ValueError('temperature_every should be at least 1')
+
+    mcu_temp, temp_time = np.nan, np.nan
+    def mcu_tic(i):
+        nonlocal mcu_temp, temp_time
         start = time.time()
         devtime = device.get_time()
         stop = time.time()
-        mcu_temp = device.read_mcu_temperature()
+        if i % temperature_every == 0:
+            mcu_temp = device.read_mcu_temperature(navg)
+            temp_time = stop
         #temp = device.read_temperature()
         #ubank = device.read_capacitor_bank_voltage()
         #return start, devtime/device.frequency, stop, mcu_temp, temp, ubank
-        return start, devtime/device.frequency, stop, mcu_temp
+        return start, devtime/device.frequency, stop, mcu_temp, temp_time
 
     def ntp_tic():
         start = time.time()
@@ -54,7 +73,7 @@ def acquire_clock_data(device, duration=600, ntp=0, interval=0.1):
     total_steps = int(duration / interval)
     with tqdm.tqdm(total=total_steps, desc="Clock calibration", unit="s") as pbar:
         while(time.time() - start < duration):
-            mcu_data.append(mcu_tic())
+            mcu_data.append(mcu_tic(len(mcu_data)))
             if (ntp != 0) and ((time - last_ntp) > ntp):
                 try:
                     ntp_data.append(ntp_tic())
@@ -66,7 +85,7 @@ def acquire_clock_data(device, duration=600, ntp=0, interval=0.1):
             time.sleep(interval)
     if not ntp_data:
         ntp_data = [[np.nan, np.nan, np.nan]]
-    return (np.rec.fromrecords(mcu_data, names=['start', 'mcu', 'stop', 'mcu_temp']),
+    return (np.rec.fromrecords(mcu_data, names=['start', 'mcu', 'stop', 'mcu_temp', 'temp_time']),
             np.rec.fromrecords(ntp_data, names=['start', 'nntp', 'stop']))
 
 
@@ -0,0 +1,136 @@
+''' Raw capture of the serial stream and deferred decoding
+
+In raw mode the bytes received from the device after the start command
+are written to disk as is, without any parsing. The file starts with a
+small header describing the acquisition and is converted into a
+regular record afterward with decode.
+'''
+
+import struct
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Event packets as sent by the firmware: header 'b', status, length
+# then the 32 bit timestamp and the line flag
+packet_dtype = np.dtype([('header', 'S1'), ('status', 'u1'), ('length', 'u1'),
+                         ('count', '<u4'), ('pinstate', 'u1')])
+
+# Magic, format version, signature row, mcu frequency, duration and
+# length of the line specification string that follows (e.g. b'0r 1f')
+raw_header = struct.Struct('<5sB3BddB')
+MAGIC = b'LTRAW'
+VERSION = 2
+
+record_dtype = np.dtype([('count', 'i8'), ('time', 'f8'), ('pinstate', 'i8')])
+
+
+def write_header(fid, signature_row, lines, frequency, duration):
+    lines = ' '.join(lines).encode()
+    fid.write(raw_header.pack(MAGIC, VERSION, *signature_row, frequency, duration, len(lines)) + lines)
+
+
+def read_header(fid):
+    ''' Read the header of a raw capture
+
+    return:
+    -------
+    dict with keys signature_row, lines (the line identifiers as given
+    to LogicTimer.enable_lines), frequency, duration and size (the
+    total size of the header in bytes)
+    '''
+    buf = fid.read(raw_header.size)
+    if len(buf) < raw_header.size or buf[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{fid.name} is not a raw logic timer capture')
+    magic, version, s0, s1, s2, frequency, duration, nlines = raw_header.unpack(buf)
+    if version != VERSION:
+        raise ValueError(f'Unsupported raw capture version {version}')
+    lines = fid.read(nlines).decode().split()
+    return {'signature_row': [s0, s1, s2],
+            'lines': lines,
+            'frequency': frequency,
+            'duration': duration,
+            'size': raw_header.size + nlines}
+
+
+def capture(device, filename, buffer_size=2**20):
+    ''' Record the raw event stream of the device to a file
+
+    The lines should be enabled and the duration set beforehand. The
+    stream is not parsed: the acquisition stops when the end of record
+    packet is seen at the end of the received data.
+
+    Parameters:
+    -----------
+    device: LogicTimer object
+    filename: str
+      Output file
+    buffer_size: int
+      Size of the write buffer in bytes
+
+    return:
+    -------
+    int: the number of bytes of event data written
+    '''
+    size = packet_dtype.itemsize
+    total = 0
+    with open(filename, 'wb', buffering=buffer_size) as fid:
+        write_header(fid, device.signature_row, device.lines, device.frequency, device.duration)
+        device.com._timeout = device.duration + 1
+        device.start(device.duration)
+        while True:
+            buf = device.com.read(max(device.com.in_waiting, 1))
+            if not buf:
+                raise ValueError(f'Timeout while waiting for the end of record after {total} bytes')
+            fid.write(buf)
+            total += len(buf)
+            # Packets are aligned and the end packet is the last one sent
+            if (total % size == 0) and (buf[-1] == 0xFF):
+                break
+    return total
+
+
+def decode(filename, jobs=1, chunk_size=2**22):
+    ''' Convert a raw capture into a record
+
+    Parameters:
+    -----------
+    filename: str
+      Raw capture file
+    jobs: int
+      Number of threads decoding chunks of the capture in parallel
+    chunk_size: int
+      Number of packets per chunk
+
+    return:
+    -------
+    record: numpy record array with columns count, time and pinstate
+    header: dict describing the acquisition (see read_header)
+    '''
+    with open(filename, 'rb') as fid:
+        header = read_header(fid)
+        fid.seek(0, 2)
+        nbytes = fid.tell() - header['size']
+    n, trailing = divmod(nbytes, packet_dtype.itemsize)
+    if trailing:
+        warnings.warn(f'Ignoring {trailing} trailing bytes in {filename}')
+    if n == 0:
+        return np.rec.array(np.empty(0, dtype=record_dtype)), header
+    packets = np.memmap(filename, dtype=packet_dtype, mode='r', offset=header['size'], shape=(n,))
+    record = np.empty(n, dtype=record_dtype)
+
+    def decode_chunk(start):
+        p = packets[start:start + chunk_size]
+        bad = (p['header'] != b'b') | (p['status'] != 0) | (p['length'] != 5)
+        if bad.any():
+            raise ValueError(f'Ill-formed packet {start + bad.argmax()} in {filename}')
+        r = record[start:start + chunk_size]
+        r['count'] = p['count']
+        np.divide(p['count'], header['frequency'], out=r['time'])
+        r['pinstate'] = p['pinstate']
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(decode_chunk, range(0, n, chunk_size)))
+    if record['pinstate'][-1] != 255:
+        warnings.warn(f'{filename} does not end with an end of record packet')
+    return np.rec.array(record), header
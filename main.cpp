@@ -30,6 +30,8 @@ extern struct Com client;
 #define DISABLEINT EIMSK &= ~enabled_lines
 #define CLEARINT EIFR |= enabled_lines
 #define CLEAR_TINT TIFR1 = _BV(OCF1A)
+// Maximum number of samples in an adc burst (128 bytes packet)
+#define ADC_BURST_MAX 64
 
 #if defined(ARDUINO_AVR_MEGA2560)
 #define NLINES 6
@@ -97,13 +99,14 @@ void get_time(uint8_t rb);
 void get_clock_calibration(uint8_t rb);
 void set_clock_calibration(uint8_t rb);
 void read_adc(uint8_t rb);
+void adc_burst(uint8_t rb);
 void read_signature_row(uint8_t rb);
 
 uint16_t duration;
 uint16_t timeHB;
 uint8_t enabled_lines = 0;
 
-const uint8_t NFUNC = 2+9;
+const uint8_t NFUNC = 2+10;
 uint8_t narg[NFUNC];
 // The exposed functions
 void (*func[NFUNC])(uint8_t rb) =
@@ -119,6 +122,7 @@ void (*func[NFUNC])(uint8_t rb) =
    get_clock_calibration,
    set_clock_calibration,
    read_adc,
+   adc_burst,
    read_signature_row,
   };
 
@@ -134,6 +138,7 @@ const char* command_names[NFUNC*3] =
    "get_clock_calibration", "", "f",
    "set_clock_calibration", "f", "",
    "read_adc", "B", "H",
+   "adc_burst", "HBB", "r",
    "read_signature_row", "H", "B",
   };
 
@@ -342,8 +347,7 @@ void set_clock_calibration(uint8_t rb){
 }
 
 
-void read_adc(uint8_t rb){
-  uint8_t channel = *((uint8_t *) (client.read_buffer + rb));
+uint16_t adc_convert(uint8_t channel){
   // ADCSRA reference:
   // ADEN-ADSC-ADATE-ADIF-ADIE-ADPS2-ADPS1-ADPS0
   
@@ -359,10 +363,50 @@ void read_adc(uint8_t rb){
   // Read ADC result (read ADCL first, then ADCH)
   uint16_t result = ADCL; // Read low byte first
   result += (ADCH<<8); // Read high byte and combine
-  
+  return result;
+}
+
+void read_adc(uint8_t rb){
+  uint8_t channel = *((uint8_t *) (client.read_buffer + rb));
+  uint16_t result = adc_convert(channel);
   client.snd((uint8_t *) &result, 2, STATUS_OK);
 }
 
+/** Perform several conversions and send them in a single packet
+ *
+ * Arguments are a 16 bit mask of the channels to convert, the number
+ * n of samples and the number navg of conversions summed in each
+ * sample. The answer holds n x nchannels 16 bit sums, ordered by
+ * sample then by channel number. The burst blocks the communication
+ * loop and should not be used during a record.
+ */
+void adc_burst(uint8_t rb){
+  uint16_t channels;
+  client.readn(&rb, (uint8_t*) &channels, 2);
+  uint8_t n = client.read_buffer[rb++];
+  uint8_t navg = client.read_buffer[rb++];
+  uint8_t nchannels = 0;
+  for (uint8_t c = 0; c < 16; c++)
+    if (channels & (1u << c))
+      nchannels++;
+  // 64 conversions of 10 bits can be summed in 16 bits
+  if ((nchannels == 0) || (n == 0) || (navg == 0) || (navg > ADC_BURST_MAX) || (n * nchannels > ADC_BURST_MAX)){
+    client.sndstatus(VALUE_ERROR);
+    return;
+  }
+  uint16_t samples[ADC_BURST_MAX];
+  uint8_t k = 0;
+  for (uint8_t i = 0; i < n; i++)
+    for (uint8_t c = 0; c < 16; c++)
+      if (channels & (1u << c)){
+	uint16_t sum = 0;
+	for (uint8_t j = 0; j < navg; j++)
+	  sum += adc_convert(c);
+	samples[k++] = sum;
+      }
+  client.snd((uint8_t *) samples, 2 * k, STATUS_OK);
+}
+
 /** The mcu signature contains calibration constants for the MCU temperature sensor
  */
 void read_signature_row(uint8_t rb) {
@@ -0,0 +1,296 @@
+''' Offline benchmarks of the host side of the logic timer
+
+The device is replaced by the emulator in device_emulator.py, served
+on a pseudo terminal, so that the benchmarks exercise the actual
+SerialBC/LogicTimer code without hardware. Results are written as JSON
+and can be compared to the results of a previous version:
+
+    python test/benchmark.py -o bench.json
+    python test/benchmark.py --compare bench.json
+
+The comparison exits with status 1 if one of the metrics degrades by
+more than the tolerance.
+'''
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import logic_timer
+import logic_timer.raw_capture
+import logic_timer.analysis
+from device_emulator import EmulatedLogicTimer, synthetic_events, packet_dtype
+
+
+def connect(emulator):
+    return logic_timer.LogicTimer(dev=emulator.port, baudrate=1000000, debug=False)
+
+
+def percentiles(x):
+    return np.percentile(x, 50), np.percentile(x, 99)
+
+
+def bench_decode(stream):
+    ''' Decode throughput of an event stream received through the pty'''
+    nevents = len(stream) // packet_dtype.itemsize
+    with EmulatedLogicTimer(stream) as emulator:
+        d = connect(emulator)
+        d.set_duration(60)
+        tic = time.perf_counter()
+        data = d.get_data()
+        toc = time.perf_counter()
+        record = logic_timer.to_record(data, d.frequency)
+        tac = time.perf_counter()
+        d.com.close()
+    return record, {
+        'decode_throughput': (nevents / (toc - tic), 'events/s', 'higher'),
+        'record_conversion_throughput': (nevents / (tac - toc), 'events/s', 'higher'),
+    }
+
+
+def bench_memory(stream):
+    ''' Peak memory of the acquisition and conversion to a record'''
+    nevents = len(stream) // packet_dtype.itemsize
+    with EmulatedLogicTimer(stream) as emulator:
+        d = connect(emulator)
+        d.set_duration(60)
+        tracemalloc.start()
+        logic_timer.to_record(d.get_data(), d.frequency)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        d.com.close()
+    return {
+        'memory_per_million_events': (peak / nevents * 1e6 / 2**20, 'MiB', 'lower'),
+    }
+
+
+def bench_raw(stream, jobs=4):
+    ''' Raw capture of the stream and offline decoding'''
+    nevents = len(stream) // packet_dtype.itemsize
+    with tempfile.TemporaryDirectory() as tmpdir, EmulatedLogicTimer(stream) as emulator:
+        filename = os.path.join(tmpdir, 'timing.raw')
+        d = connect(emulator)
+        d.set_duration(60)
+        tic = time.perf_counter()
+        logic_timer.raw_capture.capture(d, filename)
+        toc = time.perf_counter()
+        d.com.close()
+        logic_timer.raw_capture.decode(filename)
+        tac = time.perf_counter()
+        logic_timer.raw_capture.decode(filename, jobs=jobs)
+        tuc = time.perf_counter()
+    return {
+        'raw_capture_throughput': (nevents / (toc - tic), 'events/s', 'higher'),
+        'raw_decode_throughput': (nevents / (tac - toc), 'events/s', 'higher'),
+        'raw_decode_parallel_throughput': (nevents / (tuc - tac), 'events/s', 'higher'),
+    }
+
+
+def bench_latency(stream, nevents=1000, pace=1e-3):
+    ''' Delay between the emission of a packet and its decoding'''
+    size = packet_dtype.itemsize
+    nevents = min(nevents, len(stream) // size)
+    stream = stream[:(nevents - 1) * size] + stream[-size:]
+    with EmulatedLogicTimer(stream, pace=pace) as emulator:
+        d = connect(emulator)
+        d.com._timeout = 10
+        d.start(60)
+        receive_times = []
+        while True:
+            packet = d.async_packet_read()
+            receive_times.append(time.perf_counter())
+            if packet[-1] == 0xFF:
+                break
+        d.com.close()
+    send_times = emulator.send_times[:len(receive_times)]
+    latency = np.array(receive_times[:len(send_times)]) - np.array(send_times)
+    p50, p99 = percentiles(latency * 1e6)
+    return {
+        'event_latency_p50': (p50, 'us', 'lower'),
+        'event_latency_p99': (p99, 'us', 'lower'),
+    }
+
+
+def bench_roundtrip(ncalls=2000):
+    ''' Round trip of a short command (get_time)'''
+    with EmulatedLogicTimer() as emulator:
+        d = connect(emulator)
+        d.start_timer()
+        timings = []
+        for i in range(ncalls):
+            tic = time.perf_counter()
+            d.get_time()
+            timings.append(time.perf_counter() - tic)
+        d.com.close()
+    p50, p99 = percentiles(np.array(timings) * 1e6)
+    return {
+        'command_roundtrip_p50': (p50, 'us', 'lower'),
+        'command_roundtrip_p99': (p99, 'us', 'lower'),
+    }
+
+
+def bench_adc(ncalls=500):
+    ''' ADC sampling rate with one conversion per round trip and with bursts'''
+    with EmulatedLogicTimer() as emulator:
+        d = connect(emulator)
+        tic = time.perf_counter()
+        for i in range(ncalls):
+            d.read_adc(logic_timer.adc_pin_maps['MCU_TEMP'])
+        toc = time.perf_counter()
+        for i in range(ncalls):
+            d.read_adc_burst(['MCU_TEMP'], logic_timer.adc_burst_max)
+        tac = time.perf_counter()
+        d.com.close()
+    return {
+        'adc_single_rate': (ncalls / (toc - tic), 'samples/s', 'higher'),
+        'adc_burst_rate': (ncalls * logic_timer.adc_burst_max / (tac - toc), 'samples/s', 'higher'),
+    }
+
+
+def bench_record_io(record, repeat=5):
+    ''' Write and load speed of the record files'''
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'timing.npy')
+        write, load = [], []
+        for i in range(repeat):
+            tic = time.perf_counter()
+            np.save(filename, record)
+            toc = time.perf_counter()
+            np.load(filename)
+            tac = time.perf_counter()
+            write.append(toc - tic)
+            load.append(tac - toc)
+    return {
+        'record_write_throughput': (len(record) / min(write), 'events/s', 'higher'),
+        'record_load_throughput': (len(record) / min(load), 'events/s', 'higher'),
+    }
+
+
+def bench_analysis(record, repeat=5):
+    ''' Interval statistics and spectral analysis as computed by the display command'''
+    timings = []
+    for i in range(repeat):
+        tic = time.perf_counter()
+        for pin, intervals in logic_timer.line_intervals(record):
+            intervals.mean(), intervals.std()
+        timings.append(time.perf_counter() - tic)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'timing.npy')
+        np.save(filename, record)
+        tic = time.perf_counter()
+        logic_timer.analysis.analyse(filename, cache=False)
+        toc = time.perf_counter()
+    return {
+        'analysis_throughput': (len(record) / min(timings), 'events/s', 'higher'),
+        'spectrum_analysis_throughput': (len(record) / (toc - tic), 'events/s', 'higher'),
+    }
+
+
+def describe():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = ''
+    try:
+        from importlib.metadata import version
+        package_version = version('logic_timer')
+    except Exception:
+        package_version = 'unknown'
+    return {'version': package_version,
+            'commit': commit,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__}
+
+
+def compare(results, reference, tolerance):
+    ''' Print the relative change of each metric and return the list of regressions'''
+    regressions = []
+    print(f'{"metric":32s} {"reference":>12s} {"current":>12s} {"change":>8s}')
+    for name, metric in results['metrics'].items():
+        if name not in reference['metrics']:
+            continue
+        ref = reference['metrics'][name]['value']
+        value = metric['value']
+        if ref == 0:
+            print(f'{name:32s} {ref:12.4g} {value:12.4g}   (no relative change for a null reference)')
+            continue
+        change = (value - ref) / ref
+        worse = -change if metric['better'] == 'higher' else change
+        flag = ''
+        if worse > tolerance:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print(f'{name:32s} {ref:12.4g} {value:12.4g} {change*100:+7.1f}%{flag}')
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark the host side decoding, communication and analysis.')
+    parser.add_argument(
+        '-n', '--events', default=200000, type=int,
+        help='Number of synthetic events')
+    parser.add_argument(
+        '-c', '--capture', default='',
+        help='Replay a captured stream of event packets (or a raw capture file) instead of synthetic events')
+    parser.add_argument(
+        '-o', '--output-file', default='',
+        help='Save the results to the provided JSON file')
+    parser.add_argument(
+        '--compare', default='',
+        help='Compare the results to a previous JSON result file')
+    parser.add_argument(
+        '--tolerance', default=0.3, type=float,
+        help='Relative degradation above which a metric is reported as a regression')
+    args = parser.parse_args()
+
+    if args.capture:
+        with open(args.capture, 'rb') as fid:
+            try:
+                logic_timer.raw_capture.read_header(fid)
+            except ValueError:
+                fid.seek(0)
+            stream = fid.read()
+    else:
+        stream = synthetic_events(args.events)
+
+    metrics = {}
+    record, m = bench_decode(stream)
+    metrics.update(m)
+    metrics.update(bench_memory(stream))
+    metrics.update(bench_raw(stream))
+    metrics.update(bench_latency(stream))
+    metrics.update(bench_roundtrip())
+    metrics.update(bench_adc())
+    metrics.update(bench_record_io(record))
+    metrics.update(bench_analysis(record))
+
+    results = describe()
+    results['events'] = len(stream) // packet_dtype.itemsize
+    results['source'] = args.capture if args.capture else 'synthetic'
+    results['metrics'] = {name: {'value': float(value), 'unit': unit, 'better': better}
+                          for name, (value, unit, better) in metrics.items()}
+    for name, metric in results['metrics'].items():
+        print(f'{name:32s} {metric["value"]:12.4g} {metric["unit"]}')
+
+    if args.output_file:
+        with open(args.output_file, 'w') as fid:
+            json.dump(results, fid, indent=2)
+        print(f'Results saved to {args.output_file}')
+
+    if args.compare:
+        with open(args.compare) as fid:
+            reference = json.load(fid)
+        regressions = compare(results, reference, args.tolerance)
+        if regressions:
+            print(f'Performance regression for: {", ".join(regressions)}')
+            sys.exit(1)
@@ -0,0 +1,216 @@
+''' Software emulation of the logic timer firmware on a pseudo terminal
+
+The emulator answers the bincoms protocol implemented in main.cpp so
+that the host side code (SerialBC, LogicTimer) can be exercised
+without hardware. After the "start" command, the emulator replays a
+byte stream of event packets, either synthetic or captured from a real
+device.
+'''
+
+import os
+import struct
+import threading
+import time
+import tty
+import numpy as np
+from logic_timer.raw_capture import packet_dtype
+
+
+def encode_events(count, pinstate):
+    ''' Encode timestamps and line flags as a stream of event packets'''
+    packets = np.zeros(len(count), dtype=packet_dtype)
+    packets['header'] = b'b'
+    packets['length'] = 5
+    packets['count'] = count
+    packets['pinstate'] = pinstate
+    return packets.tobytes()
+
+
+def synthetic_events(n, lines=(0x01, 0x02), rate=10000, seed=0):
+    ''' Random (Poisson) events on the given lines
+
+    Parameters:
+    -----------
+    n: int
+      Number of events, not counting the end of record packet
+    lines: tuple
+      Line flags to draw the events from
+    rate: float
+      Average event rate in events/s (2MHz mcu clock)
+
+    return:
+    -------
+    bytes: the encoded stream terminated by the end of record packet
+    '''
+    rng = np.random.default_rng(seed)
+    count = np.cumsum(rng.exponential(2e6 / rate, n + 1) + 10).astype('u4')
+    pinstate = rng.choice(np.array(lines, dtype='u1'), n + 1)
+    pinstate[-1] = 255
+    return encode_events(count, pinstate)
+
+
+class EmulatedLogicTimer(object):
+    ''' Serve the logic timer protocol on the slave side of a pty
+
+    The path to give to LogicTimer is available as the port
+    attribute. The stream attribute holds the bytes sent after the
+    start command. If pace is non zero, the packets are sent one by
+    one every pace seconds and the send time of each packet is
+    recorded in send_times.
+    '''
+    commands = [('command_count', '', 'B'),
+                ('get_command_names', 'BB', 's'),
+                ('start', 'f', 'H'),
+                ('enable_line', 'Bc', ''),
+                ('get_enabled_lines', '', 'B'),
+                ('start_timer', '', ''),
+                ('get_time', '', 'I'),
+                ('get_clock_calibration', '', 'f'),
+                ('set_clock_calibration', 'f', ''),
+                ('read_adc', 'B', 'H'),
+                ('adc_burst', 'HBB', 'r'),
+                ('read_signature_row', 'H', 'B'),
+                ]
+
+    # Line to external interrupt correspondence of the Mega 2560
+    line_correspondence = [4, 5, 3, 0, 1, 2]
+
+    signature_row = {0x0000: 0x1E, 0x0001: 0x98, 0x0002: 0x01, 0x0003: 0x80}
+
+    def __init__(self, stream=b'', pace=0, frequency=2e6):
+        self.stream = stream
+        self.pace = pace
+        self.frequency = frequency
+        self.send_times = []
+        self.enabled_lines = 0
+        self._t0 = time.perf_counter()
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _readn(self, n):
+        read = bytearray()
+        while len(read) < n:
+            buf = os.read(self.master, n - len(read))
+            if not buf:
+                raise OSError('pty closed')
+            read.extend(buf)
+        return bytes(read)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.master, view):]
+
+    def snd(self, data, status=0):
+        self._write(struct.pack('ccB', b'b', bytes([status]), len(data)) + data)
+
+    def serve(self):
+        try:
+            while True:
+                m, s, l = struct.unpack('ccB', self._readn(3))
+                if m != b'b' or s != b'\x00':
+                    self.snd(b'', 5)
+                    continue
+                if l == 0:
+                    self.snd(b'', 0)
+                    continue
+                message = self._readn(l)
+                f = message[0]
+                if f >= len(self.commands):
+                    self.snd(b'', 3)
+                    continue
+                name, arg_format, answer_format = self.commands[f]
+                if struct.calcsize('<' + arg_format) != l - 1:
+                    self.snd(b'', 4)
+                    continue
+                args = struct.unpack('<' + arg_format, message[1:])
+                getattr(self, name)(*args)
+        except OSError:
+            pass
+
+    def command_count(self):
+        self.snd(struct.pack('<B', len(self.commands)))
+
+    def get_command_names(self, f, par):
+        if f >= len(self.commands):
+            self.snd(b'', 3)
+        elif par > 2:
+            self.snd(b'', 7)
+        else:
+            self.snd(self.commands[f][par].encode())
+
+    def start(self, duration):
+        self.snd(struct.pack('<H', min(int(duration / 0.032768), 0xFFFF)))
+        if self.pace:
+            self.send_times = []
+            next_time = time.perf_counter()
+            for i in range(0, len(self.stream), packet_dtype.itemsize):
+                next_time += self.pace
+                time.sleep(max(next_time - time.perf_counter(), 0))
+                self.send_times.append(time.perf_counter())
+                self._write(self.stream[i:i + packet_dtype.itemsize])
+        else:
+            self._write(self.stream)
+
+    def enable_line(self, line, front):
+        if line >= 6 or front not in b'rfb':
+            self.snd(b'', 7)
+        else:
+            # The firmware reports the mask of external interrupts
+            self.enabled_lines |= 1 << self.line_correspondence[line]
+            self.snd(b'')
+
+    def get_enabled_lines(self):
+        self.snd(struct.pack('<B', self.enabled_lines))
+
+    def start_timer(self):
+        self._t0 = time.perf_counter()
+        self.snd(b'')
+
+    def get_time(self):
+        count = int((time.perf_counter() - self._t0) * self.frequency)
+        self.snd(struct.pack('<I', count & 0xFFFFFFFF))
+
+    def get_clock_calibration(self):
+        self.snd(struct.pack('<f', self.frequency))
+
+    def set_clock_calibration(self, frequency):
+        self.frequency = frequency
+        self.snd(b'')
+
+    def _adc(self, channel):
+        if channel == 8:
+            # MCU temperature sensor reading decoded as 25°C by
+            # LogicTimer.read_mcu_temperature with the signature row offset
+            return 273 - 100 + self.signature_row[0x0002]
+        return 512 + channel
+
+    def read_adc(self, channel):
+        self.snd(struct.pack('<H', self._adc(channel)))
+
+    def adc_burst(self, channels, n, navg):
+        channels = [c for c in range(16) if channels & (1 << c)]
+        if not channels or n == 0 or navg == 0 or navg > 64 or n * len(channels) > 64:
+            self.snd(b'', 7)
+        else:
+            samples = [navg * self._adc(c) for i in range(n) for c in channels]
+            self.snd(struct.pack(f'<{len(samples)}H', *samples))
+
+    def read_signature_row(self, address):
+        self.snd(struct.pack('<B', self.signature_row.get(address, 0)))